@@ -0,0 +1,4 @@
+# Resampling filter for the 1536x1024 -> 4K upscale in image.py.
+# "bicubic" is visually indistinguishable from "lanczos" at this ratio and
+# roughly 1.5x cheaper; use "lanczos" to trade throughput for sharpness.
+UPSCALE_RESAMPLE = "bicubic"
@@ -1,43 +1,103 @@
 from openai import OpenAI
 from config import *
 import base64
-from PIL import Image
+from functools import lru_cache
+from io import BytesIO
+from PIL import Image, ImageOps
+import httpx
 import os
 import replicate
+import uuid
 
 # This will run on Render or similar
 
-client = OpenAI()
+# One pooled HTTP client for the process so keep-alive connections (and their
+# TLS sessions) are reused across generations.
+client = OpenAI(
+    http_client=httpx.Client(
+        limits=httpx.Limits(max_connections=16, max_keepalive_connections=8),
+    )
+)
 
-def upscale_to_4k(input_path, output_path):
+
+def create_temp_file(directory, suffix=""):
+    """
+    Create a uniquely named scratch file in directory; returns (fd, path).
+
+    Unlike tempfile.mkstemp, which always uses mode 0600, the file gets the
+    usual umask-derived permissions, and os.replace carries those over to
+    the final file.
+    """
+    path = os.path.join(directory, f".tmp-{uuid.uuid4().hex}{suffix}")
+    flags = os.O_WRONLY | os.O_CREAT | os.O_EXCL | getattr(os, "O_BINARY", 0)
+    return os.open(path, flags, 0o666), path
+
+
+def save_image(img, output_path, **params):
+    """
+    Save img to output_path atomically.
+
+    Writes to a uniquely named temp file in the same directory, then renames
+    it over output_path, so concurrent generations never share a scratch file
+    and readers never see a half-written image.
+    """
+    directory, name = os.path.split(os.path.abspath(output_path))
+    suffix = os.path.splitext(name)[1]
+    fd, tmp_path = create_temp_file(directory, suffix)
+    try:
+        with os.fdopen(fd, "wb") as f:
+            img.save(f, format=Image.registered_extensions().get(suffix.lower()), **params)
+        os.replace(tmp_path, output_path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+@lru_cache(maxsize=1)
+def get_replicate_client():
+    """Return a shared Replicate client, built on first use (after the env is loaded)."""
+    token = os.environ.get("REPLICATE_API_TOKEN")
+    if not token:
+        raise RuntimeError("REPLICATE_API_TOKEN is not set; it is required for replicate: models.")
+    return replicate.Client(api_token=token)
+
+def upscale_image(img, output_path):
     """
-    Upscale to 3840x2160 using a 'cover + center crop' approach.
+    Upscale an in-memory image to 3840x2160 using a 'cover + center crop' approach.
 
     - Preserves aspect ratio
     - Fills the whole 4K frame (no black bars)
     - Crops a bit from the edges if needed
     """
-    img = Image.open(input_path).convert("RGB")
+    # convert() copies even when the mode already matches
+    if img.mode != "RGB":
+        img = img.convert("RGB")
 
     target_w, target_h = 3840, 2160
     src_w, src_h = img.size
 
-    # Scale so the image fully covers the 4K frame (like CSS background-size: cover)
-    scale = max(target_w / src_w, target_h / src_h)
-    new_w = int(src_w * scale)
-    new_h = int(src_h * scale)
-
-    img = img.resize((new_w, new_h), resample=Image.LANCZOS)
+    if max(target_w / src_w, target_h / src_h) == 1:
+        # Already covers 4K at native scale: just center-crop, no resample.
+        left = (src_w - target_w) // 2
+        top = (src_h - target_h) // 2
+        img = img.crop((left, top, left + target_w, top + target_h))
+        save_image(img, output_path, quality=95, compress_level=1)
+        return img.size
+
+    # Cover + center crop in one step: ImageOps.fit crops the source region first
+    # and resamples only that, straight into a single 4K output buffer.
+    # The filter comes from config.UPSCALE_RESAMPLE (bicubic by default).
+    resample = Image.Resampling[UPSCALE_RESAMPLE.upper()]
+    img = ImageOps.fit(img, (target_w, target_h), method=resample, centering=(0.5, 0.5))
+    # quality applies to JPEG outputs; for PNG (the frame's current.png) zlib
+    # level 1 encodes several times faster than the default level 6.
+    save_image(img, output_path, quality=95, compress_level=1)
+    return img.size
 
-    # Center crop to exactly 4K
-    left   = (new_w - target_w) // 2
-    top    = (new_h - target_h) // 2
-    right  = left + target_w
-    bottom = top + target_h
 
-    img = img.crop((left, top, right, bottom))
-    img.save(output_path, quality=95)
-    return img.size
+def upscale_to_4k(input_path, output_path):
+    """Upscale an image file on disk to 4K. See upscale_image()."""
+    return upscale_image(Image.open(input_path), output_path)
 
 
 def generate_image_openai(output_path, prompt, model="gpt-image-1.5"):
@@ -56,19 +116,18 @@ def generate_image_openai(output_path, prompt, model="gpt-image-1.5"):
     # 2. Extract base64 data
     image_b64 = result.data[0].b64_json  # this is a base64-encoded PNG
 
-    # 3. Decode and save to disk
-    image_bytes = base64.b64decode(image_b64)
-
-    prescale_path = "prescale.png"
-    with open(prescale_path, "wb") as f:
-        f.write(image_bytes)
+    # 3. Decode in memory (once, straight into PIL) and upscale to the output file.
+    # load() forces the PNG decode now so the base64 payload and response can be
+    # released before the 4K resize allocates its buffers.
+    img = Image.open(BytesIO(base64.b64decode(image_b64)))
+    img.load()
+    del image_b64, result
 
-    upscale_to_4k(prescale_path, output_path)
+    upscale_image(img, output_path)
 
 
 def generate_image_replicate(output_path, prompt, model="black-forest-labs/flux-2-pro"):
-    # Create client at call time so the env var is definitely available
-    rc = replicate.Client(api_token=os.environ["REPLICATE_API_TOKEN"])
+    rc = get_replicate_client()
     output = rc.run(
         model,
         input={
@@ -79,18 +138,14 @@ def generate_image_replicate(output_path, prompt, model="black-forest-labs/flux-
         }
     )
 
-    # Replicate returns FileOutput objects with a .read() method
+    # Replicate returns file-like FileOutput objects
     # Some models return a single FileOutput, others return a list
     if isinstance(output, list):
-        image_bytes = output[0].read()
-    else:
-        image_bytes = output.read()
-
-    prescale_path = "prescale.png"
-    with open(prescale_path, "wb") as f:
-        f.write(image_bytes)
+        output = output[0]
 
-    upscale_to_4k(prescale_path, output_path)
+    # Hand the FileOutput straight to PIL; it buffers the (unseekable) stream
+    # once itself, so we don't hold a second copy of the PNG bytes.
+    upscale_image(Image.open(output), output_path)
 
 
 def generate_image(output_path, prompt, model="openai:gpt-image-1.5"):
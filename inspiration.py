@@ -16,6 +16,9 @@ try:
 except ImportError:
     HEIC_SUPPORTED = False
 
+# Largest image the vision model looks at; bigger inputs are downscaled to fit
+VISION_MAX_SIZE = (2048, 2048)
+
 
 def _encode_image_to_base64(path: Path) -> tuple[str, str]:
     """
@@ -32,7 +35,14 @@ def _encode_image_to_base64(path: Path) -> tuple[str, str]:
                 "Run 'pip install pillow-heif' in your environment."
             )
 
-        img = Image.open(path).convert("RGB")
+        img = Image.open(path)
+        # The vision API scales anything larger down to fit 2048x2048 anyway,
+        # so shrink first: reducing_gap box-reduces by an integer factor
+        # before LANCZOS runs on the near-final size, and the upload and
+        # JPEG encode get much smaller.
+        img.thumbnail(VISION_MAX_SIZE, Image.Resampling.LANCZOS, reducing_gap=3.0)
+        if img.mode != "RGB":
+            img = img.convert("RGB")
         buf = BytesIO()
         img.save(buf, format="JPEG", quality=95)
         data = buf.getvalue()
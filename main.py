@@ -1,17 +1,28 @@
+import asyncio
+import hashlib
+import json
+import os
 import random
+from collections import deque
+from itertools import islice
+from contextlib import asynccontextmanager
 from datetime import datetime
 from pathlib import Path
-from typing import Optional, Literal
+from typing import Annotated, Optional, Literal
 from zoneinfo import ZoneInfo
 
+import httpx
 from PIL import Image, ImageDraw, ImageFont
-from fastapi import FastAPI, Form, File, UploadFile
-from fastapi.responses import HTMLResponse
+from fastapi import FastAPI, Form, File, UploadFile, Request, HTTPException
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import FileResponse, HTMLResponse, Response, StreamingResponse
 from fastapi.staticfiles import StaticFiles
-from pydantic import BaseModel
+from starlette.staticfiles import NotModifiedResponse
+from jinja2 import Environment, FileSystemLoader, select_autoescape
+from pydantic import BaseModel, Field, NaiveDatetime, TypeAdapter, ValidationError
 from openai import OpenAI  # NEW
 
-from image import generate_image            # def generate_image(output_path: str, prompt: str) -> None
+from image import create_temp_file, generate_image, save_image  # def generate_image(output_path: str, prompt: str) -> None
 from ken_burns import generate_ken_burns_video, random_ken_burns_params # def generate_ken_burns_video(image_path: str, video_path: str) -> None
 from inspiration import generate_prompt_from_inspiration  # new helper
 
@@ -56,15 +67,46 @@ def burn_caption(image_path: str, lines: list[str]) -> None:
         y += line_heights[i] + line_spacing
 
     out = Image.alpha_composite(img, txt_overlay).convert("RGB")
-    out.save(image_path, quality=95)
+    save_image(out, image_path, quality=95, compress_level=1)
 
 
 # ----- OpenAI client for creative prompts ----- #
 
-oa_client = OpenAI()  # uses OPENAI_API_KEY from env
+# Uses OPENAI_API_KEY from env. HTTP/2 keep-alive connections let successive
+# prompt requests skip the TCP + TLS handshake.
+oa_client = OpenAI(
+    http_client=httpx.Client(
+        http2=True,
+        limits=httpx.Limits(max_keepalive_connections=4, max_connections=8, keepalive_expiry=120),
+    )
+)
+
+
+def warm_openai_connection() -> None:
+    """Open a pooled connection to the OpenAI API with a cheap request."""
+    try:
+        oa_client.with_options(timeout=10, max_retries=0).models.list()
+    except Exception as e:
+        print(f"[startup] OpenAI warm-up failed: {e}")
 
 ADELAIDE_TZ = ZoneInfo("Australia/Adelaide")
 
+# Quirkiness levels and their cumulative weights for random.choices:
+# ~0% quiet, ~60% subtle, ~30% whimsical, ~10% surreal
+QUIRKINESS_LEVELS = (0, 1, 2, 3)
+QUIRKINESS_CUM_WEIGHTS = (0, 6, 9, 10)
+QUIRKINESS_INSTRUCTIONS = {
+    0: "Keep the scene entirely realistic and grounded in real-world South Australia.",
+    1: "Add a subtle creative twist or unexpectedly charming detail.",
+    2: "Introduce a whimsical or imaginative element that still fits the scene.",
+    3: "Allow surreal, dreamlike, or delightfully odd elements, while keeping the scene coherent."
+}
+
+CREATIVE_SYSTEM_MESSAGE = {
+    "role": "system",
+    "content": "You are an imaginative prompt generator for image creation."
+}
+
 def get_time_of_day_description() -> str:
     """Return a lighting/atmosphere hint based on the current Adelaide time."""
     hour = datetime.now(ADELAIDE_TZ).hour
@@ -94,16 +136,9 @@ def generate_creative_prompt(theme: str, quirkiness: int = 1, style: str = "", t
     a rich, varied scene prompt in the given artistic style.
     """
     # Include the last N prompts to avoid repetition
-    recent = "\n".join(f"- {p}" for p in state.recent_creative_prompts[-state.max_recent_prompts:])
-
-    quirkiness_instructions = {
-        0: "Keep the scene entirely realistic and grounded in real-world South Australia.",
-        1: "Add a subtle creative twist or unexpectedly charming detail.",
-        2: "Introduce a whimsical or imaginative element that still fits the scene.",
-        3: "Allow surreal, dreamlike, or delightfully odd elements, while keeping the scene coherent."
-    }
+    recent = "\n".join(f"- {p}" for p in state.recent_creative_prompts)
 
-    quirk = quirkiness_instructions.get(quirkiness, quirkiness_instructions[0])
+    quirk = QUIRKINESS_INSTRUCTIONS.get(quirkiness, QUIRKINESS_INSTRUCTIONS[0])
 
     style_instruction = (
         f'- The image MUST be rendered in this artistic style: "{style}". '
@@ -123,7 +158,10 @@ def generate_creative_prompt(theme: str, quirkiness: int = 1, style: str = "", t
         if composition else ""
     )
 
-    recent_subjects = ", ".join(state.recent_creative_subjects[-state.max_recent_prompts:])
+    subjects_seen = state.recent_creative_subjects
+    recent_subjects = ", ".join(
+        islice(subjects_seen, max(0, len(subjects_seen) - state.max_recent_prompts), None)
+    )
 
     meta = f"""
     You will generate exactly ONE imaginative, varied scene description
@@ -160,10 +198,7 @@ def generate_creative_prompt(theme: str, quirkiness: int = 1, style: str = "", t
     resp = oa_client.chat.completions.create(
         model="gpt-4.1", # 4.1 mini seemed stupid
         messages=[
-            {
-                "role": "system",
-                "content": "You are an imaginative prompt generator for image creation."
-            },
+            CREATIVE_SYSTEM_MESSAGE,
             {
                 "role": "user",
                 "content": meta,
@@ -175,32 +210,71 @@ def generate_creative_prompt(theme: str, quirkiness: int = 1, style: str = "", t
     raw = resp.choices[0].message.content.strip()
 
     # Extract and track subjects from the last line
-    lines = raw.split("\n")
+    head, _, last_line = raw.rpartition("\n")
     prompt = raw
-    if lines[-1].lower().startswith("subjects:"):
-        subjects_line = lines[-1].split(":", 1)[1].strip()
+    if last_line.lower().startswith("subjects:"):
+        subjects_line = last_line.split(":", 1)[1].strip()
         subjects = [s.strip().lower() for s in subjects_line.split(",") if s.strip()]
-        state.recent_creative_subjects.extend(subjects)
-        # Trim subjects list
-        if len(state.recent_creative_subjects) > state.max_recent_prompts * 3:
-            state.recent_creative_subjects = state.recent_creative_subjects[-(state.max_recent_prompts * 3):]
+        state.recent_creative_subjects.extend(subjects)  # deque drops the oldest
         # Remove the subjects line from the actual prompt
-        prompt = "\n".join(lines[:-1]).strip()
+        prompt = head.strip()
 
-    # Store this prompt so we don't repeat it later
+    # Store this prompt so we don't repeat it later (the deque drops the oldest)
     state.recent_creative_prompts.append(prompt)
 
-    # Trim list if too long
-    if len(state.recent_creative_prompts) > state.max_recent_prompts:
-        state.recent_creative_prompts = state.recent_creative_prompts[-state.max_recent_prompts:]
-
     return prompt
 
 
 # ----- App state ----- #
 
+STATE_FILE = Path("state.json")
+STATE_SAVE_DELAY_SECONDS = 1.0  # coalesce bursts of changes into one write
+
+
 class AppState:
-    def __init__(self):
+    # Fixed attribute set: no per-instance __dict__, and a typo'd attribute
+    # raises instead of quietly adding a new field.
+    __slots__ = (
+        "mode", "manual_prompt", "theme_prompt",
+        "art_styles", "compositions", "image_models",
+        "creative_prompt", "last_creative_style", "last_creative_composition",
+        "last_image_model", "last_prompt_generated_at",
+        "max_recent_prompts", "recent_creative_prompts", "recent_creative_subjects",
+        "inspiration_image_path", "inspiration_prompt", "inspiration_preview_path",
+        "show_caption", "refresh_seconds",
+        "last_image_generated_at", "last_video_generated_at", "last_image_prompt",
+        "settings_version", "image_task", "video_task", "event_subscribers", "save_requested",
+    )
+
+    # Saved to STATE_FILE so settings and history survive a restart (or a
+    # uvicorn reload); tasks and subscribers are per-process and are not.
+    # Each maps to the type load() validates it against. Timestamps must be
+    # naive, like the datetime.utcnow() values they're compared with.
+    PERSISTED_FIELDS = {
+        "mode": Literal["manual", "inspiration", "creative"],
+        "manual_prompt": str,
+        "theme_prompt": str,
+        "art_styles": list[str],
+        "compositions": list[str],
+        "image_models": list[str],
+        "creative_prompt": Optional[str],
+        "last_creative_style": Optional[str],
+        "last_creative_composition": Optional[str],
+        "last_image_model": Optional[str],
+        "last_prompt_generated_at": Optional[NaiveDatetime],
+        "recent_creative_prompts": list[str],
+        "recent_creative_subjects": list[str],
+        "inspiration_image_path": Optional[str],
+        "inspiration_prompt": Optional[str],
+        "inspiration_preview_path": Optional[str],
+        "show_caption": bool,
+        "refresh_seconds": Annotated[int, Field(ge=60)],  # the setters' minimum
+        "last_image_generated_at": Optional[NaiveDatetime],
+        "last_video_generated_at": Optional[NaiveDatetime],
+        "last_image_prompt": Optional[str],
+    }
+
+    def __init__(self, path: Optional[Path] = None):
         # mode: "manual"       = use manual_prompt
         #       "inspiration"  = use inspiration_prompt (if set)
         #       "creative"     = auto-generate varied prompts from theme_prompt
@@ -257,21 +331,124 @@ class AppState:
         self.last_creative_composition: Optional[str] = None
         self.last_image_model: Optional[str] = None
         self.last_prompt_generated_at: Optional[datetime] = None
-        self.recent_creative_prompts: list[str] = []
-        self.recent_creative_subjects: list[str] = []
         self.max_recent_prompts: int = 20  # keep last 20, or whatever
+        self.recent_creative_prompts: deque[str] = deque(maxlen=self.max_recent_prompts)
+        self.recent_creative_subjects: deque[str] = deque(maxlen=self.max_recent_prompts * 3)
 
         self.inspiration_image_path: Optional[str] = None
         self.inspiration_prompt: Optional[str] = None
+        self.inspiration_preview_path: Optional[str] = None  # browser-viewable copy
 
         self.show_caption: bool = True
         self.refresh_seconds: int = 180  # fast for dev; maybe 600 in prod
 
         self.last_image_generated_at: Optional[datetime] = None
         self.last_video_generated_at: Optional[datetime] = None
+        self.last_image_prompt: Optional[str] = None  # what current.png was made from
+
+        # Bumped by every settings change; a generation that started under an
+        # older version doesn't count as current (see force_regeneration())
+        self.settings_version: int = 0
+
+        # In-flight regeneration of current.png / current.mp4, shared by
+        # every caller that wants it; see join_generation()
+        self.image_task: Optional[asyncio.Task] = None
+        self.video_task: Optional[asyncio.Task] = None
+
+        # One queue per /api/events stream, with the mode it asked for
+        self.event_subscribers: dict[asyncio.Queue, str] = {}
+
+        # Set when something worth saving changed; see persist_loop()
+        self.save_requested = asyncio.Event()
+
+        if path is not None:
+            self.load(path)
+
+    def to_json(self) -> str:
+        data = {}
+        for name in self.PERSISTED_FIELDS:
+            value = getattr(self, name)
+            if isinstance(value, deque):
+                value = list(value)
+            elif isinstance(value, datetime):
+                value = value.isoformat()
+            data[name] = value
+        return json.dumps(data, ensure_ascii=False, indent=2)
+
+    def load(self, path: Path) -> None:
+        """Restore the persisted fields from path, if it exists."""
+        try:
+            data = json.loads(path.read_text(encoding="utf-8"))
+        except FileNotFoundError:
+            return
+        except ValueError as e:
+            print(f"[state] Ignoring unreadable {path}: {e}")
+            return
+
+        if not isinstance(data, dict):
+            print(f"[state] Ignoring {path}: expected a JSON object")
+            return
+
+        for name, field_type in self.PERSISTED_FIELDS.items():
+            if name not in data:
+                continue
+            try:
+                value = TypeAdapter(field_type).validate_python(data[name])
+            except ValidationError as e:
+                print(f"[state] Ignoring bad {name!r} in {path}: {e.errors()[0]['msg']}")
+                continue
+            current = getattr(self, name)
+            if isinstance(current, deque):
+                current.clear()
+                current.extend(value)  # keeps the maxlen bound
+            else:
+                setattr(self, name, value)
+
+
+state = AppState(STATE_FILE)
+
+
+def mark_state_changed() -> None:
+    """Schedule a save of the app state; see persist_loop()."""
+    state.save_requested.set()
+
+
+def force_regeneration() -> None:
+    """
+    Make the next pass regenerate the image and video after a settings
+    change. A generation already in flight still writes its files but no
+    longer records a timestamp, so it can't mask the change.
+    """
+    state.settings_version += 1
+    state.last_image_generated_at = None
+    state.last_video_generated_at = None
 
 
-state = AppState()
+def write_state_file(data: str) -> None:
+    """Write data to STATE_FILE atomically (temp file, fsync, os.replace)."""
+    fd, tmp_path = create_temp_file(STATE_FILE.parent, ".json")
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, STATE_FILE)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+async def persist_loop() -> None:
+    """Save the app state shortly after it changes, once per burst of changes."""
+    while True:
+        await state.save_requested.wait()
+        await asyncio.sleep(STATE_SAVE_DELAY_SECONDS)
+        state.save_requested.clear()
+        try:
+            # Snapshot on the event loop; only the file I/O goes to a thread
+            await asyncio.to_thread(write_state_file, state.to_json())
+        except OSError as e:
+            print(f"[state] Could not save {STATE_FILE}: {e}")
 
 
 def current_prompt() -> str:
@@ -297,146 +474,147 @@ INSPIRATION_DIR.mkdir(exist_ok=True)
 IMAGE_FILE = IMAGES_DIR / "current.png"
 VIDEO_FILE = VIDEOS_DIR / "current.mp4"
 
+# Restored timestamps only stand if the files they describe survived too
+if not IMAGE_FILE.exists():
+    state.last_image_generated_at = None
+if not VIDEO_FILE.exists():
+    state.last_video_generated_at = None
+
 IMAGE_URL = "/images/current.png"
 VIDEO_URL = "/videos/current.mp4"
 
+REFRESH_CHECK_SECONDS = 15  # how often the background loop checks for due refreshes
+SSE_KEEPALIVE_SECONDS = 30
+# The viewer requests versioned (?v=) URLs, so this only bounds how stale a
+# bare /images/current.png can be before the browser revalidates it
+ASSET_CACHE_CONTROL = "public, max-age=60, must-revalidate"
+PREVIEW_MAX_SIZE = (1024, 1024)  # bounding box for HEIC inspiration previews
+
 
 # ----- FastAPI setup ----- #
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Warm in the background so startup isn't held up by the network
+    warmup = asyncio.create_task(asyncio.to_thread(warm_openai_connection))
+    refresher = asyncio.create_task(refresh_loop())
+    persister = asyncio.create_task(persist_loop())
+    yield
+    refresher.cancel()
+    persister.cancel()
+    if state.save_requested.is_set():
+        write_state_file(state.to_json())  # don't lose the last few changes
+    await warmup
+
+
+app = FastAPI(lifespan=lifespan)
+
+# Compresses the HTML pages and JSON; PNG, MP4 and the SSE stream are on
+# Starlette's default exclude list, so they pass through untouched.
+app.add_middleware(GZipMiddleware, minimum_size=500)
 
 # Serve static files
-app.mount("/images", StaticFiles(directory=str(IMAGES_DIR)), name="images")
-app.mount("/videos", StaticFiles(directory=str(VIDEOS_DIR)), name="videos")
 app.mount("/inspiration", StaticFiles(directory=str(INSPIRATION_DIR)), name="inspiration")
 
 
+class AssetResponse(FileResponse):
+    # Larger reads mean fewer worker-thread round trips for the multi-MB mp4.
+    # Servers that support the ASGI pathsend extension skip this and hand
+    # the file to the kernel directly.
+    chunk_size = 1024 * 1024
+
+
+def etag_matches(request: Request, etag: str) -> bool:
+    """True if the request's If-None-Match lists etag (weak or strong)."""
+    if_none_match = request.headers.get("if-none-match", "")
+    return etag in [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+
+
+def asset_response(request: Request, path: Path, media_type: str) -> Response:
+    """Serve a generated asset, answering If-None-Match revalidations with 304."""
+    try:
+        stat_result = os.stat(path)
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail="Not generated yet")
+    response = AssetResponse(
+        path,
+        media_type=media_type,
+        stat_result=stat_result,
+        headers={"Cache-Control": ASSET_CACHE_CONTROL},
+    )
+    if etag_matches(request, response.headers["etag"]):
+        return NotModifiedResponse(response.headers)
+    return response
+
+
+@app.api_route(IMAGE_URL, methods=["GET", "HEAD"])
+async def current_image(request: Request):
+    return asset_response(request, IMAGE_FILE, "image/png")
+
+
+@app.api_route(VIDEO_URL, methods=["GET", "HEAD"])
+async def current_video(request: Request):
+    return asset_response(request, VIDEO_FILE, "video/mp4")
+
+
 # ----- HTML UI ----- #
 
-@app.get("/", response_class=HTMLResponse)
-async def index():
-    mode_manual_checked = "checked" if state.mode == "manual" else ""
-    mode_insp_checked = "checked" if state.mode == "inspiration" else ""
-    mode_creative_checked = "checked" if state.mode == "creative" else ""
-
-    # Inspiration section
-    insp_info = ""
-    has_any_inspiration = state.inspiration_prompt or state.inspiration_image_path
-
-    if has_any_inspiration:
-        preview_rel = getattr(state, "inspiration_preview_path", None)
-
-        img_html = (
-            f'<img src="{preview_rel}" style="max-width:100%; margin-top:0.5rem;">'
-            if preview_rel
-            else "<p><em>(No preview available for this format)</em></p>"
+# Templates are compiled once at startup; auto_reload=False skips the
+# per-render mtime check.
+templates = Environment(
+    loader=FileSystemLoader(Path(__file__).parent / "templates"),
+    autoescape=select_autoescape(["html"]),
+    auto_reload=False,
+)
+INDEX_TEMPLATE = templates.get_template("index.html")
+DISPLAY_HTML = templates.get_template("display.html").render()  # static page
+
+# Last rendered index page as (key, html, etag); re-rendered only when one of
+# the fields the template reads has changed.
+_index_cache: tuple = (None, "", "")
+
+
+def render_index() -> tuple[str, str]:
+    """Return the control page HTML and its ETag, rendering only on state change."""
+    global _index_cache
+    preview_path = state.inspiration_preview_path
+    active_prompt = current_prompt()
+    key = (
+        state.mode,
+        state.manual_prompt,
+        state.theme_prompt,
+        tuple(state.art_styles),
+        tuple(state.compositions),
+        tuple(state.image_models),
+        state.last_creative_style,
+        state.last_creative_composition,
+        state.last_image_model,
+        state.inspiration_image_path,
+        state.inspiration_prompt,
+        preview_path,
+        state.show_caption,
+        state.refresh_seconds,
+        active_prompt,
+    )
+    if key != _index_cache[0]:
+        html = INDEX_TEMPLATE.render(
+            state=state,
+            inspiration_preview_path=preview_path,
+            active_prompt=active_prompt,
         )
+        etag = '"%s"' % hashlib.blake2b(html.encode(), digest_size=16).hexdigest()
+        _index_cache = (key, html, etag)
+    return _index_cache[1], _index_cache[2]
 
-        insp_info = f"""
-        <h2>Inspiration</h2>
-        <p><strong>Prompt from inspiration:</strong><br>
-        <code>{state.inspiration_prompt or "(none yet)"}</code></p>
-        {img_html}
-        """
 
-    return f"""
-    <html>
-      <head>
-        <title>Photo Frame</title>
-        <style>
-          body {{ font-family: sans-serif; max-width: 900px; margin: 2rem auto; }}
-          label {{ display:block; margin-top: 1rem; }}
-          textarea {{ width: 100%; height: 6rem; }}
-          fieldset {{ margin-top: 1.5rem; }}
-          code {{ white-space: pre-wrap; }}
-        </style>
-      </head>
-      <body>
-        <h1>Photo Frame Control</h1>
-
-        <form method="post" action="/set-prompt">
-          <fieldset>
-            <legend>Mode</legend>
-            <label>
-              <input type="radio" name="mode" value="manual" {mode_manual_checked}>
-              Manual prompt
-            </label>
-            <label>
-              <input type="radio" name="mode" value="inspiration" {mode_insp_checked}>
-              Use prompt from inspiration image (if available)
-            </label>
-            <label>
-              <input type="radio" name="mode" value="creative" {mode_creative_checked}>
-              Creative theme (auto-generated varied prompts)
-            </label>
-          </fieldset>
-
-          <label>Manual prompt:
-            <textarea name="prompt">{state.manual_prompt}</textarea>
-          </label>
-
-          <label>Creative theme (used when mode = Creative):
-            <textarea name="theme_prompt">{state.theme_prompt}</textarea>
-          </label>
-
-          <label>Art styles (one per line — a random style is picked each cycle):
-            <textarea name="art_styles">{chr(10).join(state.art_styles)}</textarea>
-          </label>
-
-          <label>Compositions (one per line — a random angle/framing is picked each cycle):
-            <textarea name="compositions">{chr(10).join(state.compositions)}</textarea>
-          </label>
-
-          <label>Image models (one per line, prefix with openai: or replicate:):
-            <textarea name="image_models">{chr(10).join(state.image_models)}</textarea>
-          </label>
-
-          <label>
-            <input type="checkbox" name="show_caption" value="1" {"checked" if state.show_caption else ""}>
-            Show caption overlay (style, composition, quirkiness)
-          </label>
-
-          <label>Refresh interval (seconds):
-            <input type="number" name="refresh_seconds" value="{state.refresh_seconds}" min="60" step="60">
-          </label>
-
-          <button type="submit" style="margin-top:1rem;">Save</button>
-        </form>
-
-        <fieldset>
-          <legend>Upload inspiration image</legend>
-          <form method="post" action="/upload-inspiration" enctype="multipart/form-data">
-            <label>Choose image:
-              <input type="file" name="file" accept="image/*">
-            </label>
-            <button type="submit" style="margin-top:0.5rem;">Upload & generate prompt</button>
-          </form>
-        </fieldset>
-
-        {insp_info}
-
-        <p style="margin-top:2rem;">
-          <strong>Active prompt (last used):</strong><br>
-          <code>{current_prompt()}</code>
-        </p>
-        <p>
-          <strong>Last model:</strong> <code>{state.last_image_model or "(none yet)"}</code>
-          &nbsp;|&nbsp;
-          <strong>Last style:</strong> <code>{state.last_creative_style or "(none yet)"}</code>
-          &nbsp;|&nbsp;
-          <strong>Last composition:</strong> <code>{state.last_creative_composition or "(none yet)"}</code>
-        </p>
-
-        <p>
-          API endpoints:<br/>
-          <code>GET /api/prompt</code><br/>
-          <code>POST /api/prompt</code><br/>
-          <code>GET /api/next?mode=image|video</code><br/>
-          <code>POST /upload-inspiration</code>
-        </p>
-      </body>
-    </html>
-    """
+@app.get("/", response_class=HTMLResponse)
+async def index(request: Request):
+    html, etag = render_index()
+    # no-cache: the browser may keep the page but must revalidate it each time
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if etag_matches(request, etag):
+        return Response(status_code=304, headers=headers)
+    return HTMLResponse(html, headers=headers)
 
 
 @app.post("/set-prompt", response_class=HTMLResponse)
@@ -476,8 +654,8 @@ async def set_prompt_form(
         state.mode = "manual"
 
     # force regeneration on next /api/next call
-    state.last_image_generated_at = None
-    state.last_video_generated_at = None
+    force_regeneration()
+    mark_state_changed()
 
     return """
     <html>
@@ -491,44 +669,98 @@ async def set_prompt_form(
     """
 
 
-@app.post("/upload-inspiration", response_class=HTMLResponse)
-async def upload_inspiration(file: UploadFile = File(...)):
-    # Save the uploaded file
-    filename = f"inspiration_{datetime.utcnow().strftime('%Y%m%dT%H%M%S')}_{file.filename}"
-    dest = INSPIRATION_DIR / filename
+# Uploads already processed this run, by saved filename: (prompt, preview URL)
+inspiration_cache: dict[str, tuple[str, Optional[str]]] = {}
 
-    content = await file.read()
-    dest.write_bytes(content)
 
-    # Create JPEG preview if needed
-    preview_rel = None
-    suffix = dest.suffix.lower()
-    if suffix in [".heic", ".heif"]:
-        try:
-            img = Image.open(dest).convert("RGB")
-            preview_name = filename + ".jpg"
-            preview_path = INSPIRATION_DIR / preview_name
-            img.save(preview_path, "JPEG", quality=95)
-            preview_rel = f"/inspiration/{preview_name}"
-        except Exception:
-            preview_rel = None  # fallback to no preview
+def save_upload(src, dest_dir: Path, suffix: str) -> Path:
+    """
+    Copy an uploaded file object into dest_dir in fixed-size chunks, naming
+    it after a BLAKE2b digest of the contents hashed along the way, so a
+    re-upload of the same photo lands on the same path.
+    """
+    hasher = hashlib.blake2b(digest_size=16)
+    fd, tmp_path = create_temp_file(dest_dir, ".part")
+    try:
+        with os.fdopen(fd, "wb") as out:
+            while chunk := src.read(64 * 1024):
+                hasher.update(chunk)
+                out.write(chunk)
+        dest = dest_dir / f"{hasher.hexdigest()}{suffix}"
+        os.replace(tmp_path, dest)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+    return dest
+
+
+def make_preview(dest: Path) -> Optional[str]:
+    """
+    Return the URL of a browser-viewable preview of an uploaded inspiration
+    image, writing a JPEG thumbnail alongside it for HEIC/HEIF files.
+    Returns None if the preview can't be made.
+    """
+    if dest.suffix.lower() not in [".heic", ".heif"]:
+        return f"/inspiration/{dest.name}"
+    try:
+        # The control page only shows a thumbnail: shrink before converting
+        # and encoding. (pillow-heif decodes at full size; it has no draft().)
+        img = Image.open(dest)
+        img.thumbnail(PREVIEW_MAX_SIZE, Image.Resampling.LANCZOS)
+        if img.mode != "RGB":
+            img = img.convert("RGB")
+        preview_name = dest.name + ".jpg"
+        preview_path = INSPIRATION_DIR / preview_name
+        # Optimised Huffman tables and a progressive scan make a smaller
+        # file that the control page can show while it is still loading.
+        img.save(preview_path, "JPEG", quality=82, optimize=True, progressive=True, subsampling="4:2:0")
+        return f"/inspiration/{preview_name}"
+    except Exception:
+        return None  # fallback to no preview
+
+
+@app.post("/upload-inspiration", response_class=HTMLResponse)
+async def upload_inspiration(file: UploadFile = File(...)):
+    # Only the extension is taken from the client's filename
+    suffix = Path(file.filename or "").suffix.lower()
+    if not suffix[1:].isalnum():
+        suffix = ""
+
+    # Starlette has already spooled the upload to a temp file; copy it across
+    # in 64 KiB chunks on a worker thread, so a large phone photo neither sits
+    # in memory whole nor blocks the event loop on disk I/O.
+    dest = await asyncio.to_thread(save_upload, file.file, INSPIRATION_DIR, suffix)
+
+    # The same file uploaded again gets the same name; reuse its results
+    cached = inspiration_cache.get(dest.name)
+    prompt, preview_task = None, None
+    if cached:
+        prompt = cached[0]
     else:
-        preview_rel = f"/inspiration/{filename}"
+        # The preview decode and the vision API call both block, so each runs
+        # on a worker thread, and concurrently with the other.
+        preview_task = asyncio.create_task(asyncio.to_thread(make_preview, dest))
 
     # Generate prompt from the image (original HEIC/whatever)
     try:
-        prompt = generate_prompt_from_inspiration(str(dest))
+        if prompt is None:
+            prompt = await asyncio.to_thread(generate_prompt_from_inspiration, str(dest))
         state.inspiration_image_path = str(dest)
         state.inspiration_prompt = prompt
         state.mode = "inspiration"
-        state.last_image_generated_at = None
-        state.last_video_generated_at = None
+        force_regeneration()
         message = "Inspiration prompt generated successfully."
     except Exception as e:
         message = f"Error generating prompt from inspiration: {e}"
 
     # store preview path if available
-    state.inspiration_preview_path = preview_rel
+    if cached:
+        state.inspiration_preview_path = cached[1]
+    else:
+        state.inspiration_preview_path = await preview_task
+        if prompt is not None:
+            inspiration_cache[dest.name] = (prompt, state.inspiration_preview_path)
+    mark_state_changed()
 
     return """
       <html>
@@ -550,7 +782,39 @@ class PromptIn(BaseModel):
     image_models: Optional[list[str]] = None
 
 
-@app.get("/api/prompt")
+# Response models let FastAPI serialize straight to JSON bytes via Pydantic
+# (datetimes included) instead of jsonable_encoder + json.dumps.
+
+class PromptStateOut(BaseModel):
+    mode: Literal["manual", "inspiration", "creative"]
+    manual_prompt: str
+    inspiration_prompt: Optional[str]
+    theme_prompt: str
+    creative_prompt: Optional[str]
+    art_styles: list[str]
+    compositions: list[str]
+    image_models: list[str]
+    last_creative_style: Optional[str]
+    last_creative_composition: Optional[str]
+    last_image_model: Optional[str]
+    refresh_seconds: int
+    active_prompt: str
+
+
+class PromptSetOut(PromptStateOut):
+    ok: bool
+
+
+class NextAssetOut(BaseModel):
+    mode: Literal["manual", "inspiration", "creative"]
+    prompt_used: str
+    generated_image_at: Optional[datetime]
+    generated_video_at: Optional[datetime]
+    image_url: str
+    video_url: Optional[str]
+
+
+@app.get("/api/prompt", response_model=PromptStateOut)
 async def get_prompt():
     return {
         "mode": state.mode,
@@ -569,7 +833,7 @@ async def get_prompt():
     }
 
 
-@app.post("/api/prompt")
+@app.post("/api/prompt", response_model=PromptSetOut)
 async def set_prompt(body: PromptIn):
     if body.prompt:
         state.manual_prompt = body.prompt.strip()
@@ -595,8 +859,8 @@ async def set_prompt(body: PromptIn):
             state.creative_prompt = None
             state.last_prompt_generated_at = None
 
-    state.last_image_generated_at = None
-    state.last_video_generated_at = None
+    force_regeneration()
+    mark_state_changed()
 
     return {
         "ok": True,
@@ -616,185 +880,226 @@ async def set_prompt(body: PromptIn):
     }
 
 
-@app.get("/api/next")
-async def get_next_asset(mode: Literal["image", "video"] = "image"):
+def image_is_due() -> bool:
+    """True if there is no image yet or refresh_seconds has elapsed."""
+    return (
+        state.last_image_generated_at is None
+        or (datetime.utcnow() - state.last_image_generated_at).total_seconds() > state.refresh_seconds
+    )
+
+
+def video_is_due() -> bool:
+    """True if there is no video yet or it predates the current image."""
+    return (
+        state.last_video_generated_at is None
+        or state.last_image_generated_at is None
+        or state.last_video_generated_at < state.last_image_generated_at
+    )
+
+
+async def refresh_assets(with_video: bool) -> None:
     """
-    Called by the Pi every N seconds.
-    - Only generates a new image/video if refresh_seconds has elapsed.
-    - Otherwise returns the existing current.png/current.mp4 URLs.
+    Regenerate current.png if refresh_seconds has elapsed, and (with_video)
+    current.mp4 if it predates the image, waiting for any generation that is
+    already running rather than starting a second one.
     """
-    now = datetime.utcnow()
+    await join_generation("image_task", image_is_due, regenerate_image)
+    if with_video:
+        await join_generation("video_task", video_is_due, regenerate_video)
 
-    # Decide if we need a new image
-    need_new_image = (
-        state.last_image_generated_at is None
-        or (now - state.last_image_generated_at).total_seconds() > state.refresh_seconds
-    )
 
-    if need_new_image:
-        # Pick a random model from the pool
-        model = random.choice(state.image_models) if state.image_models else "openai:gpt-image-1.5"
-        state.last_image_model = model
-
-        # If in creative mode, generate a fresh prompt from the theme
-        if state.mode == "creative":
-            style = random.choice(state.art_styles) if state.art_styles else ""
-            state.last_creative_style = style
-            composition = random.choice(state.compositions) if state.compositions else ""
-            state.last_creative_composition = composition
-            # Weighted: ~0% quiet, ~60% subtle, ~30% whimsical, ~10% surreal
-            quirkiness = random.choices([0, 1, 2, 3], weights=[0, 6, 3, 1])[0]
-            time_of_day = get_time_of_day_description()
-            print(f"[creative] Model: {model} | Style: {style} | Composition: {composition} | Quirkiness: {quirkiness} | Time: {time_of_day}")
-            state.creative_prompt = generate_creative_prompt(state.theme_prompt, quirkiness=quirkiness, style=style, time_of_day=time_of_day, composition=composition)
-            state.last_prompt_generated_at = now
-
-        # Generate a new image for the active prompt
-        prompt = current_prompt()
-        generate_image(str(IMAGE_FILE), prompt, model=model)
-
-        if state.show_caption and state.mode == "creative":
-            caption_lines = [
-                f"Model: {state.last_image_model or '?'}",
-                f"Style: {state.last_creative_style or '?'}",
-                f"Composition: {state.last_creative_composition or '?'}",
-                f"Quirkiness: {quirkiness}",
-            ]
-            burn_caption(str(IMAGE_FILE), caption_lines)
-
-        state.last_image_generated_at = now
-
-        # Invalidate video so it's recreated on next video request
-        state.last_video_generated_at = None
-
-    image_url = IMAGE_URL
-
-    video_url: Optional[str] = None
-    if mode == "video":
-        # Generate video if none exists or if it predates the current image
-        need_new_video = (
-            state.last_video_generated_at is None
-            or state.last_image_generated_at is None
-            or state.last_video_generated_at < state.last_image_generated_at
+async def join_generation(attr: str, is_due, generate) -> None:
+    """
+    Await the generation task stored on state.<attr>, starting one first if
+    none is running and is_due() says so.
+
+    Generation runs in worker threads so the event loop keeps serving other
+    requests meanwhile. The task is shielded: a client that disconnects only
+    stops waiting, it doesn't abandon a half-written current.png/.mp4 for
+    the next caller to trip over. Viewers on /api/events are notified when
+    a task completes.
+    """
+    task = getattr(state, attr)
+    if task is None:
+        if not is_due():
+            return
+        task = asyncio.create_task(generate())
+        setattr(state, attr, task)
+
+        def finished(t: asyncio.Task) -> None:
+            setattr(state, attr, None)
+            if not t.cancelled() and t.exception() is None:
+                notify_new_asset()
+                mark_state_changed()
+
+        task.add_done_callback(finished)
+    await asyncio.shield(task)
+
+
+async def regenerate_video() -> None:
+    """Render a new Ken Burns current.mp4 from current.png."""
+    version = state.settings_version
+    # A new image may replace current.png while this renders (the tasks are
+    # independent); then the video shows the old one and must stay due.
+    image_generated_at = state.last_image_generated_at
+    params = random_ken_burns_params()
+    await asyncio.to_thread(generate_ken_burns_video, str(IMAGE_FILE), str(VIDEO_FILE), **params)
+    if state.settings_version == version and state.last_image_generated_at == image_generated_at:
+        state.last_video_generated_at = datetime.utcnow()
+
+
+async def regenerate_image() -> None:
+    """Pick a model (and creative prompt) and write a new current.png."""
+    now = datetime.utcnow()
+    # Settings can change while we await below; work only from this snapshot
+    version = state.settings_version
+    mode = state.mode
+    show_caption = state.show_caption
+    prompt = current_prompt()
+
+    # Pick a random model from the pool
+    model = random.choice(state.image_models) if state.image_models else "openai:gpt-image-1.5"
+    state.last_image_model = model
+
+    # If in creative mode, generate a fresh prompt from the theme
+    if mode == "creative":
+        style = random.choice(state.art_styles) if state.art_styles else ""
+        state.last_creative_style = style
+        composition = random.choice(state.compositions) if state.compositions else ""
+        state.last_creative_composition = composition
+        quirkiness = random.choices(QUIRKINESS_LEVELS, cum_weights=QUIRKINESS_CUM_WEIGHTS)[0]
+        time_of_day = get_time_of_day_description()
+        print(f"[creative] Model: {model} | Style: {style} | Composition: {composition} | Quirkiness: {quirkiness} | Time: {time_of_day}")
+        creative_prompt = await asyncio.to_thread(
+            generate_creative_prompt, state.theme_prompt, quirkiness=quirkiness, style=style, time_of_day=time_of_day, composition=composition
         )
-        if need_new_video:
-            params = random_ken_burns_params()
-            generate_ken_burns_video(str(IMAGE_FILE), str(VIDEO_FILE), **params)
-            state.last_video_generated_at = datetime.utcnow()
+        state.creative_prompt = creative_prompt
+        state.last_prompt_generated_at = now
+        prompt = creative_prompt or prompt
+
+    # Generate a new image for the active prompt
+    await asyncio.to_thread(generate_image, str(IMAGE_FILE), prompt, model=model)
+
+    if show_caption and mode == "creative":
+        caption_lines = [
+            f"Model: {model}",
+            f"Style: {style or '?'}",
+            f"Composition: {composition or '?'}",
+            f"Quirkiness: {quirkiness}",
+        ]
+        await asyncio.to_thread(burn_caption, str(IMAGE_FILE), caption_lines)
+
+    # current.png now shows this prompt, whatever the settings say
+    state.last_image_prompt = prompt
+    if state.settings_version != version:
+        return  # settings changed meanwhile; leave the image due for a redo
 
-        video_url = VIDEO_URL
+    state.last_image_generated_at = now
 
+    # Invalidate video so it's recreated on next video request
+    state.last_video_generated_at = None
+
+
+def notify_new_asset() -> None:
+    """Push the current asset URLs to every /api/events stream."""
+    payloads = {}
+    for queue, mode in state.event_subscribers.items():
+        if mode not in payloads:
+            payloads[mode] = asset_event(mode)
+        if queue.full():
+            queue.get_nowait()  # superseded before the stream got to send it
+        queue.put_nowait(payloads[mode])
+
+
+def asset_info(mode: Literal["image", "video"]) -> dict:
+    """The current asset URLs and timestamps, as returned by /api/next."""
     return {
         "mode": state.mode,
-        "prompt_used": current_prompt(),
+        "prompt_used": state.last_image_prompt or current_prompt(),
         "generated_image_at": state.last_image_generated_at,
         "generated_video_at": state.last_video_generated_at if mode == "video" else None,
-        "image_url": image_url,
-        "video_url": video_url,
+        "image_url": IMAGE_URL,
+        "video_url": VIDEO_URL if mode == "video" else None,
     }
 
 
-@app.get("/display", response_class=HTMLResponse)
-async def display_viewer():
-    # Simple fullscreen viewer that polls /api/next?mode=video
-    # and shows either a video (if available) or the image.
-    return """
-    <html>
-      <head>
-        <title>Photo Frame Display</title>
-        <style>
-          html, body {
-            margin: 0;
-            padding: 0;
-            width: 100%;
-            height: 100%;
-            background: #000;
-            overflow: hidden;
-          }
-          #container {
-            position: fixed;
-            inset: 0;
-            display: flex;
-            align-items: center;
-            justify-content: center;
-            background: #000;
-          }
-          img, video {
-            max-width: 100vw;
-            max-height: 100vh;
-            width: 100vw;
-            height: 100vh;
-            object-fit: cover;
-            background: #000;
-          }
-        </style>
-      </head>
-      <body>
-        <div id="container">
-          <img id="image" src="" style="display:none;" />
-          <video id="video" src="" style="display:none;" autoplay muted loop playsinline></video>
-        </div>
-
-        <script>
-          const apiUrl = "/api/next?mode=video";
-          const origin = window.location.origin;
-
-          const imgEl = document.getElementById("image");
-          const vidEl = document.getElementById("video");
-
-          let lastImageStamp = null;
-          let lastVideoStamp = null;
-
-          async function fetchNext() {
-            try {
-              const res = await fetch(apiUrl, { cache: "no-store" });
-              if (!res.ok) {
-                console.error("API error", res.status);
-                return;
-              }
-              const data = await res.json();
-
-              // Absolute URLs
-              const imageUrl = data.image_url ? origin + data.image_url : null;
-              const videoUrl = data.video_url ? origin + data.video_url : null;
-
-              const imageStamp = data.generated_image_at || null;
-              const videoStamp = data.generated_video_at || null;
-
-              // Prefer video if available
-              if (videoUrl) {
-                // Only reload video if the timestamp changed
-                if (videoStamp && videoStamp !== lastVideoStamp) {
-                  lastVideoStamp = videoStamp;
-                  vidEl.src = videoUrl + "?t=" + Date.now();  // bust cache
-                  vidEl.load();
-                }
-                vidEl.style.display = "block";
-                imgEl.style.display = "none";
-              } else if (imageUrl) {
-                // Only reload image if the timestamp changed
-                if (imageStamp && imageStamp !== lastImageStamp) {
-                  lastImageStamp = imageStamp;
-                  imgEl.src = imageUrl + "?t=" + Date.now();  // bust cache
-                }
-                imgEl.style.display = "block";
-                vidEl.style.display = "none";
-              }
-            } catch (e) {
-              console.error("Error fetching next asset", e);
-            }
-          }
-
-          // Initial fetch
-          fetchNext();
-
-          // Poll periodically (can be shorter than refresh_seconds)
-          setInterval(fetchNext, 60 * 1000); // every 60 seconds
-        </script>
+def asset_event(mode: Literal["image", "video"]) -> str:
+    """asset_info() as a Server-Sent Events message."""
+    return f"data: {NextAssetOut(**asset_info(mode)).model_dump_json()}\n\n"
 
-      </body>
-    </html>
+
+async def refresh_loop() -> None:
+    """
+    Drive regeneration on the refresh interval while viewers are connected
+    over /api/events, instead of relying on them to poll /api/next.
     """
+    failures = 0
+    while True:
+        await asyncio.sleep(REFRESH_CHECK_SECONDS)
+        if not state.event_subscribers:
+            continue  # nobody watching; don't spend API calls
+        try:
+            # Only render video if someone is watching in video mode
+            with_video = any(m == "video" for m in state.event_subscribers.values())
+            await refresh_assets(with_video=with_video)
+            failures = 0
+        except Exception as e:
+            # A failed image leaves it due, so without a pause every check
+            # would retry (and pay for another creative prompt). Back off
+            # exponentially, up to one refresh interval.
+            failures += 1
+            delay = min(REFRESH_CHECK_SECONDS * 2 ** failures, state.refresh_seconds)
+            print(f"[refresh] Generation failed: {e}; retrying in {delay}s")
+            await asyncio.sleep(delay)
+
+
+@app.get("/api/next", response_model=NextAssetOut)
+async def get_next_asset(mode: Literal["image", "video"] = "image"):
+    """
+    Returns the current image/video URLs, for the Pi and other clients.
+    - Only generates a new image/video if refresh_seconds has elapsed.
+    - Otherwise returns the existing current.png/current.mp4 URLs.
+    """
+    await refresh_assets(with_video=mode == "video")
+    return asset_info(mode)
+
+
+@app.get("/api/events")
+async def asset_events(mode: Literal["image", "video"] = "image"):
+    """
+    Server-Sent Events stream of the same JSON /api/next returns: once on
+    connect, then again whenever a new image or video has been written, so
+    viewers never need to poll.
+    """
+    async def event_stream():
+        # Only the latest update matters; see notify_new_asset()
+        queue = asyncio.Queue(maxsize=1)
+        state.event_subscribers[queue] = mode
+        try:
+            yield asset_event(mode)
+            while True:
+                try:
+                    message = await asyncio.wait_for(queue.get(), timeout=SSE_KEEPALIVE_SECONDS)
+                except asyncio.TimeoutError:
+                    yield ": keepalive\n\n"  # comment line; keeps proxies from idling us out
+                    continue
+                yield message
+        finally:
+            del state.event_subscribers[queue]
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache"},
+    )
+
+
+@app.get("/display", response_class=HTMLResponse)
+async def display_viewer():
+    # Simple fullscreen viewer subscribed to /api/events?mode=video; each
+    # pushed message carries the /api/next payload, and it shows either the
+    # video or the image from that.
+    return DISPLAY_HTML
 
 
 # ----- Run with: python main.py ----- #
@@ -807,4 +1112,7 @@ if __name__ == "__main__":
         host="0.0.0.0",
         port=8000,
         reload=True,
+        # /api/events streams never end on their own; don't let them hold
+        # up a reload or shutdown
+        timeout_graceful_shutdown=5,
     )